@@ -1,15 +1,18 @@
-import asyncio
-import base64
 import os
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional
 
+import pybase64
 from dotenv import load_dotenv
 from google import genai
 
+from out_queue import OutQueue
+
                          
 load_dotenv()
 
+_AUDIO_MIME_24K = "audio/pcm;rate=24000"
+
 
 def _get_env(name: str) -> str:
     v = os.getenv(name)
@@ -19,11 +22,19 @@ def _get_env(name: str) -> str:
 
 
 def b64e(b: bytes) -> str:
-    return base64.b64encode(b).decode("ascii")
+    return pybase64.b64encode(b).decode("ascii")
 
 
 def b64d(s: str) -> bytes:
-    return base64.b64decode(s.encode("ascii"))
+    return pybase64.b64decode(s, validate=False)
+
+
+def _audio_evt(data_b64: str) -> Dict[str, Any]:
+    return {"type": "audio", "data": data_b64, "mime_type": _AUDIO_MIME_24K}
+
+
+def _is_audio_evt(evt: Dict[str, Any]) -> bool:
+    return evt.get("type") == "audio"
 
 
 @dataclass
@@ -46,26 +57,23 @@ class GeminiLiveBridge:
         )
         self._model = model
         self._config = config
+        self._ctx = None
         self._session = None
 
     async def __aenter__(self):
-        self._session = await (
-            self._client.aio.live.connect(
-                model=self._model,
-                config=self._config,
-            ).__aenter__()
+        self._ctx = self._client.aio.live.connect(
+            model=self._model,
+            config=self._config,
         )
+        self._session = await self._ctx.__aenter__()
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
-        if self._session is not None:
-            await (
-                self._client.aio.live.connect(
-                    model=self._model,
-                    config=self._config,
-                ).__aexit__(exc_type, exc, tb)
-            )
+        ctx = self._ctx
+        self._ctx = None
         self._session = None
+        if ctx is not None:
+            await ctx.__aexit__(exc_type, exc, tb)
 
     async def send_audio_b64(self, *, data_b64: str, mime_type: str):
         if self._session is None:
@@ -90,39 +98,36 @@ class GeminiLiveBridge:
         except Exception:
             pass
 
-    async def recv_loop(self, out_q: asyncio.Queue):
+    async def recv_loop(self, out_q: OutQueue):
         if self._session is None:
             raise RuntimeError("Session not started")
+        if not isinstance(out_q, OutQueue):
+            raise TypeError("recv_loop needs an OutQueue to shed and clear audio")
 
         while True:
             turn = self._session.receive()
             async for resp in turn:
-                sc = getattr(resp, "server_content", None)
-                if sc and getattr(sc, "model_turn", None):
-                    parts = getattr(sc.model_turn, "parts", []) or []
+                # SDK messages are pydantic models: every field exists and is
+                # None when unset, so plain attribute access is safe here.
+                sc = resp.server_content
+                if sc is None:
+                    continue
+                if sc.model_turn:
+                    parts = sc.model_turn.parts or []
                     for part in parts:
-                        inline = getattr(part, "inline_data", None)
+                        inline = part.inline_data
                         if inline and isinstance(
-                            getattr(inline, "data", None),
+                            inline.data,
                             (bytes, bytearray),
                         ):
-                            await out_q.put(
-                                {
-                                    "type": "audio",
-                                    "data": b64e(bytes(inline.data)),
-                                    "mime_type": "audio/pcm;rate=24000",
-                                }
+                            out_q.put_audio_nowait(
+                                _audio_evt(b64e(inline.data)), _is_audio_evt
                             )
-                        text = getattr(part, "text", None)
-                        if isinstance(text, str) and text.strip():
+                        text = part.text
+                        if isinstance(text, str) and text and not text.isspace():
                             await out_q.put(
                                 {"type": "text", "text": text}
                             )
 
-                interrupted = getattr(sc, "interrupted", False) if sc else False
-                if interrupted:
-                    while not out_q.empty():
-                        try:
-                            out_q.get_nowait()
-                        except Exception:
-                            break
+                if sc.interrupted:
+                    out_q.clear()
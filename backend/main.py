@@ -1,13 +1,16 @@
 ﻿import os
-import json
-import base64
+import sys
+import time
 import asyncio
-from datetime import datetime
-from typing import Any, Dict, Optional, List
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, List, Union
 
 from fastapi import Body, FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+import orjson
+import pybase64
 from google import genai
 from dotenv import load_dotenv
 from mcp import ClientSession
@@ -19,22 +22,27 @@ except ImportError:
         streamablehttp_client as streamable_http_client,
     )
 
+try:
+    from mcp.shared.exceptions import McpError
+except ImportError:
+    from mcp.shared.exceptions import MCPError as McpError
 
-def log_evt(tag: str, msg: str):
-    ts = datetime.now().isoformat(timespec="seconds")
-    print(f"[{tag}][{ts}] {msg}")
-
-
-def log_mcp(msg: str):
-    log_evt("MCP", msg)
+from out_queue import OutQueue
 
+mcp_log = logging.getLogger("MCP")
+ws_log = logging.getLogger("WS")
+gemini_log = logging.getLogger("Gemini")
 
-def log_ws(msg: str):
-    log_evt("WS", msg)
 
+class CachedTimeFormatter(logging.Formatter):
+    # Timestamps have one-second resolution, so format each second only once.
+    _cached_time: tuple[int, str] = (-1, "")
 
-def log_gemini(msg: str):
-    log_evt("Gemini", msg)
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None):
+        sec = int(record.created)
+        if sec != self._cached_time[0]:
+            self._cached_time = (sec, super().formatTime(record, datefmt))
+        return self._cached_time[1]
 
 
 def _truncate(s: str, limit: int = 500) -> str:
@@ -43,12 +51,8 @@ def _truncate(s: str, limit: int = 500) -> str:
     return s[:limit] + f"... <truncated {len(s) - limit} chars>"
 
 
-def b64e(b: bytes) -> str:
-    return base64.b64encode(b).decode("ascii")
-
-
 def b64d(s: str) -> bytes:
-    return base64.b64decode(s.encode("ascii"))
+    return pybase64.b64decode(s, validate=False)
 
 
 def build_realtime_input_config() -> Dict[str, Any]:
@@ -64,28 +68,149 @@ def build_realtime_input_config() -> Dict[str, Any]:
     }
 
 
+def build_default_config() -> Dict[str, Any]:
+    # Built fresh for every connection so per-session overrides never leak.
+    return {
+        "response_modalities": ["AUDIO"],
+        "system_instruction": "You are a helpful and friendly salon voice assistant.",
+        "realtime_input_config": build_realtime_input_config(),
+    }
+
+
 load_dotenv()
 
 DEFAULT_MODEL = "gemini-2.5-flash-native-audio-preview-12-2025"
-DEFAULT_CONFIG: Dict[str, Any] = {
-    "response_modalities": ["AUDIO"],
-    "system_instruction": "You are a helpful and friendly salon voice assistant.",
-    "realtime_input_config": {
-        "automatic_activity_detection": {
-            "disabled": False,
-        },
-        "activity_handling": "START_OF_ACTIVITY_INTERRUPTS",
-        "turn_coverage": "TURN_INCLUDES_ALL_INPUT",
-    },
-}
 MCP_SERVER_URL = "http://localhost:8090/mcp"
 MCP_REQUIRED = False
+MCP_TOOLS_CACHE_TTL_S = 60.0
+OUT_QUEUE_MAXSIZE = 64
+MAX_AUDIO_B64 = 1 << 20
 CORS_ALLOW_ORIGINS = ["*"]
 HOST = "0.0.0.0"
 PORT = 8000
-DEFAULT_CONFIG["realtime_input_config"] = build_realtime_input_config()
+# uvloop has no Windows build; uvicorn falls back to the stock asyncio loop there.
+UVICORN_LOOP = "asyncio" if sys.platform == "win32" else "uvloop"
+UVICORN_LOG_LEVEL = os.getenv("UVICORN_LOG_LEVEL", "info")
+LOG_LEVEL = logging.INFO
+# Binary WebSocket frames carry raw PCM prefixed with one byte indexing this table.
+AUDIO_MIME_TYPES = ("audio/pcm;rate=16000", "audio/pcm;rate=24000")
+AUDIO_TAG_PCM_24K = b"\x01"
+
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(
+    CachedTimeFormatter("[%(name)s][%(asctime)s] %(message)s", "%Y-%m-%dT%H:%M:%S")
+)
+for _logger in (mcp_log, ws_log, gemini_log):
+    _logger.addHandler(_log_handler)
+    _logger.setLevel(LOG_LEVEL)
+    _logger.propagate = False
+
+_mcp_session: Optional[ClientSession] = None
+_mcp_session_task: Optional[asyncio.Task] = None
+_mcp_session_stop: Optional[asyncio.Event] = None
+_mcp_session_lock = asyncio.Lock()
+_tools_cache: tuple[float, tuple[list[Any], list[str], str]] | None = None
+_tools_cache_lock = asyncio.Lock()
+
+
+async def _run_mcp_session(ready: asyncio.Future, stop: asyncio.Event):
+    # The streamable HTTP transport runs inside an anyio task group that must be
+    # entered and exited by the same task, so one task owns the connection.
+    try:
+        async with streamable_http_client(MCP_SERVER_URL) as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                if not ready.done():
+                    ready.set_result(session)
+                await stop.wait()
+    except Exception as e:
+        if not ready.done():
+            ready.set_exception(e)
+        else:
+            mcp_log.warning("session closed with error %s", e)
+
+
+async def get_mcp_session() -> ClientSession:
+    global _mcp_session, _mcp_session_task, _mcp_session_stop
+    async with _mcp_session_lock:
+        if (
+            _mcp_session is not None
+            and _mcp_session_task is not None
+            and not _mcp_session_task.done()
+        ):
+            return _mcp_session
+
+        mcp_log.info("session connect url=%s", MCP_SERVER_URL)
+        ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        stop = asyncio.Event()
+        task = asyncio.create_task(_run_mcp_session(ready, stop))
+        try:
+            session = await ready
+        except BaseException:
+            stop.set()
+            raise
+        _mcp_session, _mcp_session_task, _mcp_session_stop = session, task, stop
+        mcp_log.info("session ready")
+        return session
+
+
+async def close_mcp_session(session: Optional[ClientSession] = None):
+    global _mcp_session, _mcp_session_task, _mcp_session_stop
+    async with _mcp_session_lock:
+        if session is not None and session is not _mcp_session:
+            return
+        task, stop = _mcp_session_task, _mcp_session_stop
+        _mcp_session = _mcp_session_task = _mcp_session_stop = None
+    if stop is not None:
+        stop.set()
+    if task is not None:
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def is_mcp_session_rejected(e: Exception) -> bool:
+    # A 404 on a stale session id is the only case where the server never ran
+    # the request; the streamable HTTP client reports it with exactly this error.
+    return (
+        isinstance(e, McpError)
+        and e.error.code == 32600
+        and e.error.message == "Session terminated"
+    )
 
-app = FastAPI()
+
+async def with_mcp_session(fn):
+    for attempt in range(2):
+        session = await get_mcp_session()
+        runner = _mcp_session_task
+        request = asyncio.ensure_future(fn(session))
+        try:
+            # A dropped connection ends the runner task but leaves in-flight
+            # requests waiting forever, so race the request against it.
+            await asyncio.wait({request, runner}, return_when=asyncio.FIRST_COMPLETED)
+            if not request.done():
+                raise ConnectionError("MCP session closed")
+            return request.result()
+        except Exception as e:
+            rejected = is_mcp_session_rejected(e)
+            # Only transport and session failures invalidate the shared session;
+            # per-request errors leave it, and other in-flight requests, alone.
+            if rejected or isinstance(e, ConnectionError) or runner.done():
+                await close_mcp_session(session)
+            # A rejected request never ran, so it is safe to retry even for
+            # non-idempotent tools. Anything else may have been delivered.
+            if not rejected or attempt:
+                raise
+            mcp_log.info("session rejected by server; reconnecting")
+        finally:
+            request.cancel()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_mcp_session()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=CORS_ALLOW_ORIGINS,
@@ -101,36 +226,55 @@ def health():
 
 
 async def mcp_list_tools():
-    log_mcp(f"discovery start url={MCP_SERVER_URL}")
-    async with streamable_http_client(MCP_SERVER_URL) as (read, write, _):
-        async with ClientSession(read, write) as session:
-            await session.initialize()
-            try:
-                tools = await session.list_tools()
-                tool_names = [t.name for t in getattr(tools, "tools", [])]
-                log_mcp(f"discovery ok tools={tool_names}")
-                return tools
-            except Exception as e:
-                log_mcp(f"discovery error {e}")
-                raise
+    mcp_log.info("discovery start url=%s", MCP_SERVER_URL)
+    try:
+        tools = await with_mcp_session(lambda session: session.list_tools())
+    except Exception as e:
+        mcp_log.warning("discovery error %s", e)
+        raise
+    tool_names = [t.name for t in getattr(tools, "tools", [])]
+    mcp_log.info("discovery ok tools=%s", tool_names)
+    return tools
+
+
+async def get_tools_cached() -> tuple[list[Any], list[str], str]:
+    global _tools_cache
+    async with _tools_cache_lock:
+        if (
+            _tools_cache is not None
+            and time.monotonic() - _tools_cache[0] < MCP_TOOLS_CACHE_TTL_S
+        ):
+            return _tools_cache[1]
+        tools = await mcp_list_tools()
+        gemini_tools = list(getattr(tools, "tools", []) or [])
+        tool_names = [t.name for t in gemini_tools]
+        tool_clause = (
+            "\n\nYou can only answer using MCP data. Available tools: "
+            + ", ".join(tool_names)
+            + ". If the data is not available from MCP, say you don't know."
+        )
+        _tools_cache = (time.monotonic(), (gemini_tools, tool_names, tool_clause))
+        return _tools_cache[1]
 
 
 async def mcp_call_tool(tool_name: str, arguments: Dict[str, Any]):
-    log_mcp(f"call start tool={tool_name} args={arguments}")
-    async with streamable_http_client(MCP_SERVER_URL) as (read, write, _):
-        async with ClientSession(read, write) as session:
-            await session.initialize()
-            try:
-                result = await session.call_tool(tool_name, arguments=arguments)
-                structured = getattr(result, "structuredContent", None)
-                content = getattr(result, "content", None)
-                log_mcp(
-                    f"call ok tool={tool_name} structured={structured is not None} content_len={len(content) if content else 0}"
-                )
-                return result
-            except Exception as e:
-                log_mcp(f"call error tool={tool_name} err={e}")
-                raise
+    mcp_log.info("call start tool=%s args=%s", tool_name, arguments)
+    try:
+        result = await with_mcp_session(
+            lambda session: session.call_tool(tool_name, arguments=arguments)
+        )
+    except Exception as e:
+        mcp_log.warning("call error tool=%s err=%s", tool_name, e)
+        raise
+    structured = getattr(result, "structuredContent", None)
+    content = getattr(result, "content", None)
+    mcp_log.info(
+        "call ok tool=%s structured=%s content_len=%d",
+        tool_name,
+        structured is not None,
+        len(content) if content else 0,
+    )
+    return result
 
 
 def mcp_result_to_payload(result: Any):
@@ -143,12 +287,15 @@ def mcp_result_to_payload(result: Any):
         first = content[0]
         text = getattr(first, "text", None)
         if isinstance(text, str):
-            try:
-                return json.loads(text)
-            except json.JSONDecodeError:
-                return {"text": text}
+            # Free-form tool text is common; only attempt a parse when it can be JSON.
+            if text.lstrip()[:1] in ("{", "["):
+                try:
+                    return orjson.loads(text)
+                except orjson.JSONDecodeError:
+                    pass
+            return {"text": text}
 
-    log_mcp("empty/unknown tool response; no structuredContent or content")
+    mcp_log.warning("empty/unknown tool response; no structuredContent or content")
     return {"error": "empty_tool_response", "raw": str(result)}
 
 
@@ -185,38 +332,102 @@ async def mcp_update_appointment(
     return mcp_result_to_payload(result)
 
 
-async def recv_json(ws: WebSocket) -> Dict[str, Any]:
-    raw = await ws.receive_text()
-    return json.loads(raw)
+async def recv_msg(ws: WebSocket) -> Union[Dict[str, Any], bytes]:
+    message = await ws.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    data = message.get("bytes")
+    if data is not None:
+        return data
+    return orjson.loads(message["text"])
 
 
 async def send_json(ws: WebSocket, obj: Dict[str, Any]):
-    encoded = json.dumps(obj, ensure_ascii=False)
-    msg_type = obj.get("type")
-    if msg_type != "audio":
-        log_ws(f"send type={msg_type} len={len(encoded)}")
-    await ws.send_text(encoded)
+    encoded = orjson.dumps(obj)
+    ws_log.debug("send type=%s len=%d", obj.get("type"), len(encoded))
+    # Binary frames are reserved for audio, so JSON still goes out as text.
+    await ws.send_text(encoded.decode("utf-8"))
+
+
+async def send_audio(ws: WebSocket, chunks: List[bytes]):
+    # Consecutive PCM chunks of the same stream can be concatenated into one frame.
+    await ws.send_bytes(b"".join((AUDIO_TAG_PCM_24K, *chunks)))
+
+
+def is_audio_item(item: Union[Dict[str, Any], bytes]) -> bool:
+    # Audio is queued as bare PCM chunks; everything else is a JSON event.
+    return isinstance(item, (bytes, bytearray))
+
+
+async def send_batch(ws: WebSocket, events: List[Union[Dict[str, Any], bytes]]):
+    audio: List[bytes] = []
+    other: List[Dict[str, Any]] = []
+    for evt in events:
+        if is_audio_item(evt):
+            if other:
+                await send_json_events(ws, other)
+                other = []
+            audio.append(evt)
+        else:
+            if audio:
+                await send_audio(ws, audio)
+                audio = []
+            other.append(evt)
+    if audio:
+        await send_audio(ws, audio)
+    if other:
+        await send_json_events(ws, other)
+
+
+async def send_json_events(ws: WebSocket, events: List[Dict[str, Any]]):
+    if len(events) == 1:
+        await send_json(ws, events[0])
+    else:
+        await send_json(ws, {"type": "batch", "items": events})
+
+
+def tool_error_response(fn_id: str, fn_name: str, error: str) -> Dict[str, Any]:
+    return {"id": fn_id, "name": fn_name, "response": {"error": error}}
 
 
-async def gemini_recv_loop(live_session, out_q: asyncio.Queue):
+async def dispatch_tool_call(
+    fn_id: str, fn_name: str, fn_args: Dict[str, Any]
+) -> Dict[str, Any]:
+    try:
+        mcp_result = await mcp_call_tool(fn_name, fn_args)
+        payload = mcp_result_to_payload(mcp_result)
+        return {"id": fn_id, "name": fn_name, "response": {"output": payload}}
+    except Exception as e:
+        mcp_log.warning("tool dispatch error tool=%s err=%s", fn_name, e)
+        return tool_error_response(fn_id, fn_name, str(e))
+
+
+async def gemini_recv_loop(live_session, out_q: OutQueue):
     try:
         while True:
             turn = live_session.receive()
             async for response in turn:
-                sc = getattr(response, "server_content", None)
-                tool_call = getattr(response, "tool_call", None)
-
-                if tool_call and getattr(tool_call, "function_calls", None):
-                    function_calls = getattr(tool_call, "function_calls", []) or []
-                    log_gemini(f"recv tool_call count={len(function_calls)}")
-                    function_responses: List[Dict[str, Any]] = []
+                # SDK messages are pydantic models: every field exists and is
+                # None when unset, so plain attribute access is safe here.
+                sc = response.server_content
+                tool_call = response.tool_call
+
+                if tool_call and tool_call.function_calls:
+                    function_calls = tool_call.function_calls
+                    gemini_log.info("recv tool_call count=%d", len(function_calls))
+                    # Keep one slot per answerable call so the responses go back
+                    # in the order the calls were issued; MCP calls fill theirs
+                    # once the concurrent dispatches finish.
+                    function_responses: List[Optional[Dict[str, Any]]] = []
+                    dispatches: List[tuple[int, Any]] = []
                     for fc in function_calls:
-                        fn_name = getattr(fc, "name", None)
-                        fn_id = getattr(fc, "id", None)
-                        fn_args = getattr(fc, "args", None) or {}
+                        fn_name = fc.name
+                        fn_id = fc.id
+                        fn_args = fc.args or {}
                         if not isinstance(fn_id, str) or not fn_id:
-                            log_gemini(
-                                f"recv tool_call missing id for name={fn_name}; skipping"
+                            gemini_log.warning(
+                                "recv tool_call missing id for name=%s; skipping",
+                                fn_name,
                             )
                             await out_q.put(
                                 {
@@ -227,85 +438,93 @@ async def gemini_recv_loop(live_session, out_q: asyncio.Queue):
                             continue
                         if not isinstance(fn_name, str) or not fn_name:
                             function_responses.append(
-                                {
-                                    "id": fn_id,
-                                    "name": fn_name or "unknown_tool",
-                                    "response": {"error": "missing_function_name"},
-                                }
+                                tool_error_response(
+                                    fn_id,
+                                    fn_name or "unknown_tool",
+                                    "missing_function_name",
+                                )
                             )
                             continue
                         if not isinstance(fn_args, dict):
                             fn_args = {}
-
-                        try:
-                            mcp_result = await mcp_call_tool(fn_name, fn_args)
-                            payload = mcp_result_to_payload(mcp_result)
-                            function_responses.append(
-                                {
-                                    "id": fn_id,
-                                    "name": fn_name,
-                                    "response": {"output": payload},
-                                }
-                            )
-                        except Exception as e:
-                            log_mcp(f"tool dispatch error tool={fn_name} err={e}")
-                            function_responses.append(
-                                {
-                                    "id": fn_id,
-                                    "name": fn_name,
-                                    "response": {"error": str(e)},
-                                }
+                        dispatches.append(
+                            (
+                                len(function_responses),
+                                dispatch_tool_call(fn_id, fn_name, fn_args),
                             )
+                        )
+                        function_responses.append(None)
+
+                    results = await asyncio.gather(*(call for _, call in dispatches))
+                    for (index, _), result in zip(dispatches, results):
+                        function_responses[index] = result
 
                     if function_responses:
                         await live_session.send_tool_response(
                             function_responses=function_responses
                         )
-                        log_gemini(
-                            f"sent tool_response count={len(function_responses)}"
+                        gemini_log.info(
+                            "sent tool_response count=%d", len(function_responses)
                         )
 
-                if sc and getattr(sc, "model_turn", None):
-                    for part in getattr(sc.model_turn, "parts", []) or []:
-                        inline = getattr(part, "inline_data", None)
-                        if inline and isinstance(
-                            getattr(inline, "data", None), (bytes, bytearray)
-                        ):
-                            await out_q.put(
-                                {
-                                    "type": "audio",
-                                    "data": b64e(bytes(inline.data)),
-                                    "mime_type": "audio/pcm;rate=24000",
-                                }
-                            )
-                        text = getattr(part, "text", None)
-                        if isinstance(text, str) and text.strip():
-                            log_gemini(
-                                f"recv text len={len(text)} preview={_truncate(text, 200)}"
-                            )
+                if sc is None:
+                    continue
+                if sc.model_turn:
+                    for part in sc.model_turn.parts or []:
+                        inline = part.inline_data
+                        if inline and isinstance(inline.data, (bytes, bytearray)):
+                            out_q.put_audio_nowait(inline.data, is_audio_item)
+                        text = part.text
+                        if isinstance(text, str) and text and not text.isspace():
+                            if gemini_log.isEnabledFor(logging.DEBUG):
+                                gemini_log.debug(
+                                    "recv text len=%d preview=%s",
+                                    len(text),
+                                    _truncate(text, 200),
+                                )
                             await out_q.put({"type": "text", "text": text})
 
-                interrupted = getattr(sc, "interrupted", False) if sc else False
-                if interrupted:
-                    log_gemini("recv interrupted")
-                    while not out_q.empty():
-                        try:
-                            out_q.get_nowait()
-                        except Exception:
-                            break
+                if sc.interrupted:
+                    gemini_log.info("recv interrupted")
+                    out_q.clear()
                     await out_q.put({"type": "interrupted"})
     except Exception as e:
-        log_gemini(f"recv error {e}")
+        gemini_log.warning("recv error %s", e)
         await out_q.put({"type": "error", "message": f"Gemini receive error: {e}"})
 
 
-async def handle_client_msg(msg: Dict[str, Any], ws: WebSocket, live_session):
+async def handle_client_audio_frame(frame: bytes, ws: WebSocket, live_session):
+    tag = frame[0] if frame else None
+    if tag is None or tag >= len(AUDIO_MIME_TYPES):
+        await send_json(ws, {"type": "error", "message": f"Unknown audio tag: {tag}"})
+        return
+    await live_session.send_realtime_input(
+        audio={"data": frame[1:], "mime_type": AUDIO_MIME_TYPES[tag]}
+    )
+
+
+async def handle_client_msg(
+    msg: Union[Dict[str, Any], bytes], ws: WebSocket, live_session
+):
+    if isinstance(msg, bytes):
+        await handle_client_audio_frame(msg, ws, live_session)
+        return
+
     t = msg.get("type")
 
     if t == "audio":
         data_b64 = msg.get("data")
         mime_type = msg.get("mime_type", "audio/pcm;rate=16000")
         if isinstance(data_b64, str):
+            n = len(data_b64)
+            if n & 3 or n > MAX_AUDIO_B64:
+                await send_json(
+                    ws,
+                    {"type": "error", "message": f"Invalid audio payload length: {n}"},
+                )
+                return
+            # The SDK's Blob only accepts bytes (it copies bytearrays and rejects
+            # memoryviews), so decoding into a reused buffer would add a copy.
             await live_session.send_realtime_input(
                 audio={"data": b64d(data_b64), "mime_type": mime_type}
             )
@@ -315,7 +534,7 @@ async def handle_client_msg(msg: Dict[str, Any], ws: WebSocket, live_session):
             await live_session.send_realtime_input(text=text)
     elif t == "interrupt":
         try:
-            log_gemini("send interrupt via activity_end")
+            gemini_log.info("send interrupt via activity_end")
             await live_session.send_realtime_input(activity_end={})
         except Exception:
             pass
@@ -328,7 +547,9 @@ async def handle_client_msg(msg: Dict[str, Any], ws: WebSocket, live_session):
 
 
 async def client_to_gemini(
-    ws: WebSocket, live_session, initial_msg: Optional[Dict[str, Any]] = None
+    ws: WebSocket,
+    live_session,
+    initial_msg: Optional[Union[Dict[str, Any], bytes]] = None,
 ):
     try:
         if initial_msg is not None:
@@ -336,7 +557,7 @@ async def client_to_gemini(
 
         while True:
             try:
-                msg = await recv_json(ws)
+                msg = await recv_msg(ws)
             except WebSocketDisconnect:
                 return
             except Exception as e:
@@ -350,43 +571,47 @@ async def client_to_gemini(
 
             await handle_client_msg(msg, ws, live_session)
     except Exception as e:
-        log_gemini(f"send error {e}")
+        gemini_log.warning("send error %s", e)
         try:
             await send_json(ws, {"type": "error", "message": f"Gemini send error: {e}"})
         except Exception:
             pass
 
 
-async def gemini_to_client(ws: WebSocket, out_q: asyncio.Queue):
+async def gemini_to_client(ws: WebSocket, out_q: OutQueue):
     while True:
-        evt = await out_q.get()
-        await send_json(ws, evt)
+        batch = [await out_q.get()]
+        while True:
+            try:
+                batch.append(out_q.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        await send_batch(ws, batch)
 
 
 @app.websocket("/ws")
 async def ws_handler(ws: WebSocket):
     await ws.accept()
-    log_ws("ws accepted")
+    ws_log.info("ws accepted")
 
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise RuntimeError("Missing env var: GEMINI_API_KEY")
     client = genai.Client(api_key=api_key)
 
-    cfg = dict(DEFAULT_CONFIG)
+    cfg = build_default_config()
     model = DEFAULT_MODEL
-    log_gemini(f"config model_default={model} cfg={cfg}")
+    gemini_log.info("config model_default=%s cfg=%s", model, cfg)
 
     try:
         tool_names: list[str] = []
         gemini_tools: list[Any] = []
+        tool_clause = ""
         try:
-            tools = await mcp_list_tools()
-            tool_names = [t.name for t in getattr(tools, "tools", [])]
-            gemini_tools = list(getattr(tools, "tools", []) or [])
-            log_mcp(f"discovered tools: {tool_names}")
+            gemini_tools, tool_names, tool_clause = await get_tools_cached()
+            mcp_log.info("discovered tools: %s", tool_names)
         except Exception as e:
-            log_mcp(f"discovery failed: {e}")
+            mcp_log.warning("discovery failed: %s", e)
             if MCP_REQUIRED:
                 await send_json(
                     ws,
@@ -398,14 +623,14 @@ async def ws_handler(ws: WebSocket):
                 await ws.close()
                 return
 
-        first: Optional[Dict[str, Any]] = None
+        first: Optional[Union[Dict[str, Any], bytes]] = None
         try:
-            first = await asyncio.wait_for(recv_json(ws), timeout=2.0)
+            first = await asyncio.wait_for(recv_msg(ws), timeout=2.0)
         except Exception:
             first = None
 
-        pending_first_message: Optional[Dict[str, Any]] = None
-        if first and first.get("type") == "config":
+        pending_first_message: Optional[Union[Dict[str, Any], bytes]] = None
+        if isinstance(first, dict) and first.get("type") == "config":
             if isinstance(first.get("system_instruction"), str):
                 cfg["system_instruction"] = first["system_instruction"]
             if isinstance(first.get("response_modalities"), list):
@@ -414,35 +639,32 @@ async def ws_handler(ws: WebSocket):
                 model = first["model"].strip()
         elif first is not None:
             pending_first_message = first
-            log_ws(
-                f"first message type={first.get('type')} (accepted without config)"
-            )
+            first_type = first.get("type") if isinstance(first, dict) else "audio"
+            ws_log.info("first message type=%s (accepted without config)", first_type)
 
         if tool_names:
             cfg["system_instruction"] = (
-                f"{cfg.get('system_instruction', '').rstrip()}\n\n"
-                f"You can only answer using MCP data. Available tools: {', '.join(tool_names)}. "
-                "If the data is not available from MCP, say you don't know."
+                cfg.get("system_instruction", "").rstrip() + tool_clause
             )
         if gemini_tools:
             cfg["tools"] = gemini_tools
 
-        out_q: asyncio.Queue = asyncio.Queue()
+        out_q = OutQueue(maxsize=OUT_QUEUE_MAXSIZE)
 
         connect_ctx = None
         live_session = None
         try:
-            log_gemini(f"connect model={model} cfg={cfg}")
+            gemini_log.info("connect model=%s cfg=%s", model, cfg)
             connect_ctx = client.aio.live.connect(model=model, config=cfg)
             live_session = await connect_ctx.__aenter__()
         except Exception as e:
-            log_gemini(f"connect failed with full config: {e}")
+            gemini_log.warning("connect failed with full config: %s", e)
             minimal_cfg = {
                 k: v
                 for k, v in cfg.items()
                 if k in {"response_modalities", "system_instruction", "tools"}
             }
-            log_gemini(f"retry connect with minimal_cfg={minimal_cfg}")
+            gemini_log.info("retry connect with minimal_cfg=%s", minimal_cfg)
             connect_ctx = client.aio.live.connect(model=model, config=minimal_cfg)
             live_session = await connect_ctx.__aenter__()
 
@@ -460,6 +682,9 @@ async def ws_handler(ws: WebSocket):
             )
             for p in pending:
                 p.cancel()
+            # Wait for the cancelled tasks to unwind so none is still using
+            # live_session when the connection is closed below.
+            await asyncio.gather(*pending, return_exceptions=True)
         finally:
             if connect_ctx is not None:
                 await connect_ctx.__aexit__(None, None, None)
@@ -479,4 +704,12 @@ async def ws_handler(ws: WebSocket):
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host=HOST, port=PORT, log_level="info")
+    uvicorn.run(
+        app,
+        host=HOST,
+        port=PORT,
+        loop=UVICORN_LOOP,
+        http="httptools",
+        ws="websockets-sansio",
+        log_level=UVICORN_LOG_LEVEL,
+    )
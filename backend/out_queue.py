@@ -0,0 +1,32 @@
+import asyncio
+from typing import Any, Callable
+
+
+class OutQueue(asyncio.Queue):
+    # Bounded queue of events headed to the client. The only class that reaches
+    # into asyncio.Queue internals, so the rest of the relay stays on its API.
+
+    def clear(self):
+        # asyncio.Queue has no clear(); empty the backing deque in one step
+        # rather than draining it item by item, and release blocked producers.
+        self._queue.clear()
+        self._unfinished_tasks = 0
+        self._finished.set()
+        while self._putters:
+            self._wakeup_next(self._putters)
+
+    def put_audio_nowait(self, item: Any, is_audio: Callable[[Any], bool]):
+        # When the consumer falls behind, shed the oldest queued audio instead
+        # of blocking the receive loop. Text, error and interrupt events are
+        # never evicted; if nothing but those is queued, the new chunk is dropped.
+        try:
+            self.put_nowait(item)
+            return
+        except asyncio.QueueFull:
+            pass
+        for i, queued in enumerate(self._queue):
+            if is_audio(queued):
+                del self._queue[i]
+                self.task_done()
+                self.put_nowait(item)
+                return
@@ -1,6 +1,5 @@
 import { useEffect, useMemo, useRef, useState } from "react"
 import { RelayWS } from "./lib/wsClient"
-import { bytesToB64, b64ToBytes } from "./lib/b64"
 import { f32ToPcm16LE, resampleLinear } from "./lib/pcm"
 
 type Status = "idle" | "connecting" | "connected"
@@ -96,7 +95,7 @@ export default function App() {
                 const down = resampleLinear(merged, micRateRef.current, targetRate)
                 const pcm16 = f32ToPcm16LE(down)
                 const b = new Uint8Array(pcm16.buffer)
-                relay.send({ type: "audio", data: bytesToB64(b), mime_type: "audio/pcm;rate=16000" })
+                relay.sendAudio(b, "audio/pcm;rate=16000")
                 await new Promise((r) => setTimeout(r, 10))
             }
         } finally {
@@ -115,7 +114,7 @@ export default function App() {
             return
         }
         if (m.type === "audio") {
-            const bytes = b64ToBytes(m.data)
+            const bytes: Uint8Array = m.data
             const rate = parseRate(m.mime_type) ?? 24000
             playNodeRef.current?.port.postMessage({ type: "push", pcm16: bytes.buffer, sampleRate: rate }, [bytes.buffer])
             return
@@ -1,18 +1,22 @@
+// Audio travels as binary frames: one byte indexing this table, followed by raw PCM.
+export const AUDIO_MIME_TYPES = ["audio/pcm;rate=16000", "audio/pcm;rate=24000"]
+
 export type ClientOut =
     | { type: "config"; system_instruction?: string; response_modalities?: string[]; model?: string }
-    | { type: "audio"; data: string; mime_type: string }
     | { type: "text"; text: string }
     | { type: "interrupt" }
     | { type: "ping" }
 
 export type ServerIn =
     | { type: "ready"; model: string }
-    | { type: "audio"; data: string; mime_type: string }
+    | { type: "audio"; data: Uint8Array; mime_type: string }
     | { type: "text"; text: string }
     | { type: "interrupted" }
     | { type: "error"; message: string }
     | { type: "pong" }
 
+type ServerFrame = ServerIn | { type: "batch"; items: ServerIn[] }
+
 export class RelayWS {
     private ws: WebSocket | null = null
     private onMsg: ((m: ServerIn) => void) | null = null
@@ -22,10 +26,18 @@ export class RelayWS {
         this.onMsg = onMsg
         this.onCloseCb = onClose
         this.ws = new WebSocket(url)
+        this.ws.binaryType = "arraybuffer"
         this.ws.onmessage = (e) => {
+            if (e.data instanceof ArrayBuffer) {
+                const frame = new Uint8Array(e.data)
+                const mime_type = AUDIO_MIME_TYPES[frame[0]]
+                if (mime_type) this.onMsg?.({ type: "audio", data: frame.slice(1), mime_type })
+                return
+            }
             try {
-                const m = JSON.parse(e.data) as ServerIn
-                this.onMsg?.(m)
+                const m = JSON.parse(e.data) as ServerFrame
+                if (m.type === "batch") m.items.forEach((item) => this.onMsg?.(item))
+                else this.onMsg?.(m)
             } catch { }
         }
         this.ws.onclose = () => this.onCloseCb?.()
@@ -36,6 +48,16 @@ export class RelayWS {
         this.ws.send(JSON.stringify(msg))
     }
 
+    sendAudio(pcm: Uint8Array, mimeType: string) {
+        if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return
+        const tag = AUDIO_MIME_TYPES.indexOf(mimeType)
+        if (tag < 0) return
+        const frame = new Uint8Array(pcm.length + 1)
+        frame[0] = tag
+        frame.set(pcm, 1)
+        this.ws.send(frame)
+    }
+
     close() {
         try { this.ws?.close() } catch { }
         this.ws = null